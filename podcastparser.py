@@ -27,12 +27,19 @@ __website__ = 'http://gpodder.org/podcastparser/'
 __license__ = 'ISC License'
 
 from xml import sax
+from xml.parsers import expat
+from xml.sax import xmlreader
 
+import datetime
+import functools
+import heapq
+import operator
 import re
 import os
+import sys
 import time
 
-from html.entities import entitydefs
+from html import unescape
 
 from urllib import parse as urlparse
 from email.utils import mktime_tz, parsedate_tz
@@ -44,7 +51,7 @@ logger = logging.getLogger(__name__)
 class Target(object):
     WANT_TEXT = False
 
-    def __init__(self, key=None, filter_func=lambda x: x.strip(), overwrite=True):
+    def __init__(self, key=None, filter_func=str.strip, overwrite=True):
         self.key = key
         self.filter_func = filter_func
         self.overwrite = overwrite
@@ -58,18 +65,19 @@ class Target(object):
 
 class RSS(Target):
     def start(self, handler, attrs):
-        if 'xml:base' in attrs.keys():
+        if 'xml:base' in attrs:
             handler.set_base(attrs.get('xml:base'))
 
 
 class PodcastItem(Target):
     def end(self, handler, text):
-        by_published = lambda entry: entry.get('published')
-        order = 'type' not in handler.data or handler.data['type'] != 'serial'
-        handler.data['episodes'].sort(key=by_published, reverse=order)
+        newest_first = handler.data.get('type') != 'serial'
         if handler.max_episodes:
-            episodes = handler.data['episodes'][:handler.max_episodes]
-            handler.data['episodes'] = episodes
+            # Same result as sorting all episodes and slicing
+            heap = handler.newest_episodes if newest_first else handler.oldest_episodes
+            handler.data['episodes'] = [episode for _, _, episode in sorted(heap, reverse=True)]
+        else:
+            handler.episodes.sort(key=operator.itemgetter('published'), reverse=newest_first)
 
 
 class PodcastAttr(Target):
@@ -96,7 +104,7 @@ class PodcastAttrType(Target):
 
 class PodcastAttrRelativeLink(PodcastAttr):
     def end(self, handler, text):
-        text = urlparse.urljoin(handler.base, text.strip())
+        text = _urljoin(handler.base, text.strip())
         super(PodcastAttrRelativeLink, self).end(handler, text)
 
 
@@ -106,7 +114,7 @@ class PodcastAttrFromHref(Target):
     def start(self, handler, attrs):
         value = attrs.get(self.ATTRIBUTE)
         if value:
-            value = urlparse.urljoin(handler.base, value)
+            value = _urljoin(handler.base, value)
             handler.set_podcast_attr(self.key, self.filter_func(value))
 
 
@@ -133,25 +141,17 @@ class EpisodeAttr(Target):
 
 class EpisodeAttrRelativeLink(EpisodeAttr):
     def end(self, handler, text):
-        text = urlparse.urljoin(handler.base, text)
+        text = _urljoin(handler.base, text)
         super(EpisodeAttrRelativeLink, self).end(handler, text)
 
 
 class EpisodeGuid(EpisodeAttr):
     def start(self, handler, attrs):
-        if attrs.get('isPermaLink', 'true').lower() == 'true':
-            handler.set_episode_attr('_guid_is_permalink', True)
-        else:
-            handler.set_episode_attr('_guid_is_permalink', False)
+        handler.guid_is_permalink = attrs.get('isPermaLink', 'true').lower() == 'true'
 
     def end(self, handler, text):
-        def filter_func(guid):
-            guid = guid.strip()
-            if handler.get_episode_attr('_guid_is_permalink'):
-                return urlparse.urljoin(handler.base, guid)
-            return guid
-
-        self.filter_func = filter_func
+        if handler.guid_is_permalink:
+            text = _urljoin(handler.base, text.strip())
         EpisodeAttr.end(self, handler, text)
 
 
@@ -161,7 +161,7 @@ class EpisodeAttrFromHref(Target):
     def start(self, handler, attrs):
         value = attrs.get(self.ATTRIBUTE)
         if value:
-            value = urlparse.urljoin(handler.base, value)
+            value = _urljoin(handler.base, value)
             handler.set_episode_attr(self.key, self.filter_func(value))
 
 
@@ -202,23 +202,25 @@ class Enclosure(Target):
         self.file_size_attribute = file_size_attribute
 
     def start(self, handler, attrs):
-        url = attrs.get('url')
+        get = attrs.get
+        url = get('url')
         if url is None:
             return
 
-        url = parse_url(urlparse.urljoin(handler.base, url.lstrip()))
-        file_size = parse_length(attrs.get(self.file_size_attribute))
-        mime_type = parse_type(attrs.get('type'))
+        url = parse_url(_urljoin(handler.base, url.lstrip()))
+        file_size = parse_length(get(self.file_size_attribute))
+        mime_type = parse_type(get('type'))
 
         handler.add_enclosure(url, file_size, mime_type)
 
 
 class AtomLink(Target):
     def start(self, handler, attrs):
-        rel = attrs.get('rel', 'alternate')
-        url = parse_url(urlparse.urljoin(handler.base, attrs.get('href')))
-        mime_type = parse_type(attrs.get('type', 'text/html'))
-        file_size = parse_length(attrs.get('length', '0'))
+        get = attrs.get
+        rel = get('rel', 'alternate')
+        url = parse_url(_urljoin(handler.base, get('href')))
+        mime_type = parse_type(get('type', 'text/html'))
+        file_size = parse_length(get('length', '0'))
 
         if rel == 'enclosure':
             handler.add_enclosure(url, file_size, mime_type)
@@ -232,9 +234,10 @@ class AtomLink(Target):
 
 class PodcastAtomLink(AtomLink):
     def start(self, handler, attrs):
-        rel = attrs.get('rel', 'alternate')
-        url = parse_url(urlparse.urljoin(handler.base, attrs.get('href')))
-        mime_type = parse_type(attrs.get('type'))
+        get = attrs.get
+        rel = get('rel', 'alternate')
+        url = parse_url(_urljoin(handler.base, get('href')))
+        mime_type = parse_type(get('type'))
 
         # RFC 5005 (http://podlove.org/paged-feeds/)
         if rel == 'first':
@@ -297,22 +300,26 @@ class PodloveChapters(Target):
 
 class PodloveChapter(Target):
     def start(self, handler, attrs):
+        get = attrs.get
+        start = get('start')
+        title = get('title')
+
         # Both the start and title attributes are mandatory
-        if attrs.get('start') is None or attrs.get('title') is None:
+        if start is None or title is None:
             logger.warning('Invalid chapter (missing start and/or and title)')
             return
 
         chapter = {
-            'start': parse_time(attrs.get('start')),
-            'title': attrs.get('title'),
+            'start': parse_time(start),
+            'title': title,
         }
 
         for optional in ('href', 'image'):
-            value = attrs.get(optional)
+            value = get(optional)
             if value:
                 chapter[optional] = value
 
-        handler.get_episode_attr('chapters').append(chapter)
+        handler.append_episode_chapter(chapter)
         
         
 class EpisodePersonAttr(Target):
@@ -328,8 +335,9 @@ class EpisodePersonAttr(Target):
             "href": None,
             "img": None,
         }
+        get = attrs.get
         for optional in ("group", "role", "href", "img"):
-            value = attrs.get(optional)
+            value = get(optional)
             if value:
                 if optional in ("role", "group"):
                     value = value.lower()
@@ -429,6 +437,11 @@ class Namespace():
     def __init__(self, attrs, parent=None):
         self.namespaces = self.parse_namespaces(attrs)
         self.parent = parent
+        if parent is not None and not self.namespaces:
+            # Same prefix bindings as the parent, so share its mapped names
+            self._map_cache = parent._map_cache
+        else:
+            self._map_cache = {}
 
     @staticmethod
     def parse_namespaces(attrs):
@@ -450,11 +463,12 @@ class Namespace():
         """
         result = {}
 
-        for key in attrs.keys():
-            if key == 'xmlns':
-                result[''] = attrs[key]
-            elif key.startswith('xmlns:'):
-                result[key[6:]] = attrs[key]
+        for key, value in attrs.items():
+            if key.startswith('xmlns'):
+                if key == 'xmlns':
+                    result[''] = value
+                elif key[5] == ':':
+                    result[key[6:]] = value
 
         return result
 
@@ -472,6 +486,9 @@ class Namespace():
     def map(self, name):
         """Apply namespace prefixes for a given tag
 
+        Results are cached, as the same few tags come up over and over again.
+        Child namespaces that do not declare any prefixes share the cache.
+
         >>> namespace = Namespace({'xmlns:it':
         ...    'http://www.itunes.com/dtds/podcast-1.0.dtd'}, None)
         >>> namespace.map('it:duration')
@@ -486,13 +503,19 @@ class Namespace():
         >>> child.map('atom:link') # Undefined prefix
         'atom:link'
         """
-        if ':' not in name:
+        mapped_name = self._map_cache.get(name)
+        if mapped_name is None:
+            mapped_name = self._map_cache[name] = sys.intern(self._map(name))
+        return mapped_name
+
+    def _map(self, name):
+        namespace, sep, name = name.partition(':')
+        if not sep:
             # <duration xmlns="http://..."/>
-            namespace = ''
+            namespace, name = '', namespace
             namespace_uri = self.lookup(namespace)
         else:
             # <itunes:duration/>
-            namespace, name = name.split(':', 1)
             namespace_uri = self.lookup(namespace)
             if namespace_uri is None:
                 # Use of "itunes:duration" without xmlns:itunes="..."
@@ -534,7 +557,12 @@ def squash_whitespace(text):
     >>> squash_whitespace(' some\t   text  with a    lot of   spaces ')
     'some text with a lot of spaces'
     """
-    return re.sub(r'\s+', ' ', text.strip())
+    # str.split() splits on runs of the same characters as \s and drops
+    # leading/trailing whitespace, without going through the regex engine
+    return ' '.join(text.split())
+
+
+_WS_NOT_NL_RE = re.compile(r'[^\S\r\n]+')
 
 
 def squash_whitespace_not_nl(text):
@@ -543,7 +571,7 @@ def squash_whitespace_not_nl(text):
     >>> squash_whitespace_not_nl(' linefeeds\\ncarriage\\r  returns')
     'linefeeds\\ncarriage\\r returns'
     """
-    return re.sub(r'[^\S\r\n]+', ' ', text.strip())
+    return _WS_NOT_NL_RE.sub(' ', text.strip())
 
 
 def parse_time(value):
@@ -585,37 +613,120 @@ def parse_time(value):
     if value == '':
         return 0
 
-    hours = minutes = seconds = fraction = 0
-    parsed = False
+    if value.isdecimal():
+        return int(value)
+
+    # [[HH:]MM:]SS[.FRACT], minutes and seconds have at most two digits
+    *fields, seconds = value.split(':')
+    seconds, dot, fraction = seconds.partition('.')
+    fields.append(seconds)
+    if (len(fields) <= 3
+            and all(field.isdecimal() for field in fields)
+            and all(len(field) <= 2 for field in fields[1:])
+            and (not dot or fraction.isdecimal())):
+        result = 0
+        for field in fields:
+            result = result * 60 + int(field)
+        return result
 
-    m = re.match(r'(\d+)[:](\d\d?)[:](\d\d?)([.]\d+)?$', value)
-    if not parsed and m:
-        hours, minutes, seconds, fraction = m.groups()
-        fraction = float(fraction or 0.0)
-        parsed = True
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning('Could not parse time value: "%s"', value)
+        return 0
 
-    m = re.match(r'(\d+)[:](\d\d?)([.]\d+)?$', value)
-    if not parsed and m:
-        minutes, seconds, fraction = m.groups()
-        fraction = float(fraction or 0.0)
-        parsed = True
 
-    m = re.match(r'(\d+)([.]\d+)?$', value)
-    if not parsed and m:
-        seconds, fraction = m.groups()
-        fraction = float(fraction or 0.0)
-        parsed = True
+# Absolute http(s) URLs that urljoin() would return unchanged: a host, no
+# empty query or fragment, no ;parameters and no whitespace (urlsplit()
+# removes tabs and newlines)
+_PLAIN_HTTP_URL_RE = re.compile(r"https?://[A-Za-z0-9.:@_~%!$&'()*+,=-]+"
+                                r'(?:/[^\s;?#]*)?(?:\?[^\s#]+)?(?:#\S+)?\Z')
 
-    if not parsed:
-        try:
-            seconds = int(value)
-        except ValueError:
-            logger.warning('Could not parse time value: "%s"', value)
-            return 0
 
-    return (int(hours) * 60 + int(minutes)) * 60 + int(seconds)
+@functools.lru_cache(maxsize=1024)
+def _urljoin(base, url):
+    """Resolve url relative to base, caching the result
+
+    Items in a feed are usually resolved against the same base URL,
+    so the same (base, url) pairs come up over and over again.
+
+    >>> _urljoin('http://example.com/feed/', 'episode.mp3')
+    'http://example.com/feed/episode.mp3'
+
+    Absolute URLs (by far the most common case) are returned as-is:
 
+    >>> _urljoin('http://example.com/feed/', 'https://example.org/a.mp3')
+    'https://example.org/a.mp3'
 
+    ...unless urljoin() would normalize them:
+
+    >>> _urljoin('http://example.com/feed/', 'http://example.org/g#')
+    'http://example.org/g'
+    >>> _urljoin('http://example.com/feed/', 'http://example.org/g?')
+    'http://example.org/g'
+    >>> _urljoin('http://example.com/feed/', 'http://example.org/\\tg')
+    'http://example.org/g'
+    >>> _urljoin('http://example.com/feed/', 'http:///g')
+    'http://example.com/g'
+
+    Otherwise, this gives the same results as urllib.parse.urljoin(), but
+    works on urlsplit() (which is cached by urllib) instead of urlparse():
+
+    >>> _urljoin('http://a/b/c/d?q', '../../g')
+    'http://a/g'
+    >>> _urljoin('http://a/b/c/d?q', '?y')
+    'http://a/b/c/d?y'
+    >>> _urljoin('http://a/b/c/d?q', '//g/h')
+    'http://g/h'
+    >>> _urljoin('http://a/b/c/d?q', './g/.')
+    'http://a/b/c/g/'
+    """
+    if url and _PLAIN_HTTP_URL_RE.match(url):
+        return url
+
+    if not base:
+        return url
+    if not url:
+        return base
+    if ';' in base or ';' in url:
+        # Leave handling of ;parameters to urlparse()
+        return urlparse.urljoin(base, url)
+
+    bscheme, bnetloc, bpath, bquery, _ = urlparse.urlsplit(base)
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url, bscheme)
+    if scheme != bscheme or scheme not in urlparse.uses_relative:
+        return url
+
+    if scheme in urlparse.uses_netloc:
+        if netloc:
+            return urlparse.urlunsplit((scheme, netloc, path, query, fragment))
+        netloc = bnetloc
+
+    if not path:
+        return urlparse.urlunsplit((scheme, netloc, bpath, query or bquery, fragment))
+
+    if path[:1] == '/':
+        segments = path.split('/')
+    else:
+        segments = bpath.split('/')[:-1] + path.split('/')
+        segments[1:-1] = filter(None, segments[1:-1])
+
+    # Remove dot segments (RFC 3986, 5.2.4)
+    resolved_path = []
+    for segment in segments:
+        if segment == '..':
+            if resolved_path:
+                resolved_path.pop()
+        elif segment != '.':
+            resolved_path.append(segment)
+
+    if segments[-1] in ('.', '..'):
+        resolved_path.append('')
+
+    return urlparse.urlunsplit((scheme, netloc, '/'.join(resolved_path) or '/', query, fragment))
+
+
+@functools.lru_cache(maxsize=1024)
 def parse_url(text):
     return normalize_feed_url(text.strip())
 
@@ -634,13 +745,17 @@ def parse_length(text):
 
     >>> parse_length('100')
     100
+
+    >>> parse_length(' 100 ')
+    100
     """
 
     if text is None:
         return -1
 
     try:
-        return int(text.strip()) or -1
+        # int() ignores surrounding whitespace by itself
+        return int(text) or -1
     except ValueError:
         return -1
 
@@ -668,6 +783,62 @@ def parse_type(text):
     return text
 
 
+_ISO_DATETIME_RE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}[Tt][0-9]{2}:[0-9]{2}:[0-9]{2}')
+_TZ_RE = re.compile(r'^(?:Z|([+-])([0-9]{2})[:]([0-9]{2}))$')
+
+_RFC822_MONTHS = {month: number for number, month in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+_RFC822_UTC = ('GMT', 'UT', 'UTC', 'Z')
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def _parse_rfc822(text):
+    """Parse the common 'Day, DD Mon YYYY HH:MM:SS +ZZZZ' layout
+
+    Gives the same result as mktime_tz(parsedate_tz(text)) for dates in
+    exactly this layout, returns None for everything else.
+
+    >>> _parse_rfc822('Fri, 21 Nov 1997 09:55:06 -0600')
+    880127706
+    >>> _parse_rfc822('Fri, 21 Nov 1997 09:55:06 EST') is None
+    True
+    """
+    parts = text.split()
+    if len(parts) != 6:
+        return None
+
+    weekday, day, month, year, hms, zone = parts
+    if weekday[-1] != ',' or len(year) != 4 or not year.isdigit():
+        return None
+
+    # parsedate_tz() takes years below 100 as two-digit years
+    year = int(year)
+    if year < 100:
+        return None
+
+    month = _RFC822_MONTHS.get(month)
+    hms = hms.split(':')
+    if month is None or len(hms) != 3:
+        return None
+
+    if zone in _RFC822_UTC:
+        offset = 0
+    elif len(zone) == 5 and zone[0] in '+-' and zone[1:].isdigit() and zone != '-0000':
+        offset = int(zone[1:3]) * 3600 + int(zone[3:]) * 60
+        if zone[0] == '-':
+            offset = -offset
+    else:
+        # Other zone names, and -0000 ("no time zone information", which
+        # parsedate_tz() takes as local time)
+        return None
+
+    # Same as calendar.timegm(), which also allows days beyond the month
+    hour, minute, second = hms
+    days = datetime.date(year, month, 1).toordinal() - _EPOCH_ORDINAL + int(day) - 1
+    return ((days * 24 + int(hour)) * 60 + int(minute)) * 60 + int(second) - offset
+
+
+@functools.lru_cache(maxsize=4096)
 def parse_pubdate(text):
     """Parse a date string into a Unix timestamp
 
@@ -680,6 +851,12 @@ def parse_pubdate(text):
     >>> parse_pubdate('2003-12-13T18:30:02Z')
     1071340202
 
+    >>> parse_pubdate('2003-12-13t18:30:02Z')
+    1071340202
+
+    >>> parse_pubdate('2003-12-13T18:30+01:00')
+    0
+
     >>> parse_pubdate('Mon, 02 May 1960 09:05:01 +0100')
     -305049299
 
@@ -692,6 +869,14 @@ def parse_pubdate(text):
     if not text:
         return 0
 
+    try:
+        pubtimeseconds = _parse_rfc822(text)
+    except ValueError:
+        # Leave reporting invalid values to the generic code below
+        pubtimeseconds = None
+    if pubtimeseconds is not None:
+        return pubtimeseconds
+
     parsed = parsedate_tz(text)
     if parsed is not None:
         try:
@@ -701,23 +886,33 @@ def parse_pubdate(text):
             logger.warning('bad pubdate %s is before epoch or after end of time (2038)', parsed)
             return 0
 
+    # ISO 8601 (RFC 3339) dates, e.g. in Atom feeds
     try:
-        parsed = time.strptime(text[:19], '%Y-%m-%dT%H:%M:%S')
-        if parsed is not None:
-            m = re.match(r'^(?:Z|([+-])([0-9]{2})[:]([0-9]{2}))$', text[19:])
-            if m:
-                parsed = list(iter(parsed))
-                if m.group(1):
-                    offset = 3600 * int(m.group(2)) + 60 * int(m.group(3))
-                    if m.group(1) == '-':
-                        offset = 0 - offset
-                else:
-                    offset = 0
-                parsed.append(offset)
-                return int(mktime_tz(tuple(parsed)))
+        parsed = None
+        # fromisoformat() accepts more layouts than strptime() below,
+        # so only use it for exactly YYYY-MM-DDTHH:MM:SS
+        if _ISO_DATETIME_RE.match(text):
+            try:
+                parsed = datetime.datetime.fromisoformat(text[:19]).timetuple()
+            except ValueError:
+                # Leap seconds and other values fromisoformat() rejects
+                pass
+        if parsed is None:
+            parsed = time.strptime(text[:19], '%Y-%m-%dT%H:%M:%S')
+        m = _TZ_RE.match(text[19:])
+        if m:
+            parsed = list(iter(parsed))
+            if m.group(1):
+                offset = 3600 * int(m.group(2)) + 60 * int(m.group(3))
+                if m.group(1) == '-':
+                    offset = 0 - offset
             else:
-                return int(time.mktime(parsed))
-    except Exception:
+                offset = 0
+            parsed.append(offset)
+            return int(mktime_tz(tuple(parsed)))
+        else:
+            return int(time.mktime(parsed))
+    except (OverflowError, ValueError):
         pass
 
     logger.error('Cannot parse date: %s', repr(text))
@@ -813,6 +1008,53 @@ MAPPING = {
 VALID_ROOTS = set(path.split('/')[0] for path in MAPPING.keys())
 
 
+def _target_methods(target):
+    """Resolve the (start, end, WANT_TEXT) of a target once
+
+    Methods that are not overridden are None, so that calling the no-op
+    Target.start() and Target.end() can be skipped.
+
+    >>> start, end, want_text = _target_methods(PodcastAttr('title'))
+    >>> start is None, end is not None, want_text
+    (True, True, True)
+    """
+    cls = type(target)
+    start = target.start if cls.start is not Target.start else None
+    end = target.end if cls.end is not Target.end else None
+    return start, end, target.WANT_TEXT
+
+
+def _build_trie(mapping):
+    """Turn the paths of a MAPPING into a trie of element names
+
+    Each node maps the names of the child elements to a (node, methods)
+    pair, methods being the _target_methods() of the child's target (or
+    None for elements that only lead to a target).
+
+    >>> trie = _build_trie({'rss/channel/title': PodcastAttr('title')})
+    >>> rss, methods = trie['rss']
+    >>> channel, methods = rss['channel']
+    >>> methods is None, list(channel)
+    (True, ['title'])
+    """
+    trie = {}
+    for path, target in mapping.items():
+        # Element names are interned (as are the mapped names of parsed
+        # elements), so comparing keys on lookup only compares pointers
+        names = [sys.intern(name) for name in path.split('/')]
+        node = trie
+        for name in names[:-1]:
+            node = node.setdefault(name, ({}, None))[0]
+        children, _ = node.get(names[-1], ({}, None))
+        node[names[-1]] = (children, _target_methods(target))
+    return trie
+
+
+# Parsing follows the trie from element to element, so that no path has
+# to be built and looked up; elements not in the trie are skipped
+_MAPPING_TRIE = _build_trie(MAPPING)
+
+
 class FeedParseError(sax.SAXParseException, ValueError):
     """
     Exception raised when asked to parse an invalid feed
@@ -828,14 +1070,37 @@ class PodcastHandler(sax.handler.ContentHandler):
         self.url = url
         self.max_episodes = max_episodes
         self.base = url
-        self.text = None
+        # All character data (also whitespace between elements and text of
+        # skipped subtrees) since a WANT_TEXT target started or any target
+        # ended; joined as the text of WANT_TEXT targets when they end
+        self.text = []
+        self.want_text = False
         self.episodes = []
+        # The current episode, added to episodes once it has been validated
+        self.episode = None
+        # With max_episodes, only the newest and the oldest max_episodes
+        # episodes are kept (which of them is returned depends on the
+        # itunes:type, which can come after the items), as heaps of
+        # (published, sequence number, episode) with the next episode to
+        # drop first; the sequence number keeps ties in document order
+        self.newest_episodes = []
+        self.oldest_episodes = []
+        self.episode_count = 0
         self.data = {
             'title': file_basename_no_extension(url),
             'episodes': self.episodes,
         }
-        self.path_stack = []
+        # _MAPPING_TRIE node of the current element
+        self.node = _MAPPING_TRIE
+        # (parent node, target methods) of the open mapped elements
+        self.stack = []
+        # Depth inside an element that has no MAPPING entries below it
+        self.skip_depth = 0
         self.namespace = None
+        # Namespaces of the parents of the current element
+        self.namespace_stack = []
+        # isPermaLink of the current episode's GUID
+        self.guid_is_permalink = False
 
     def set_base(self, base):
         self.base = base
@@ -844,19 +1109,23 @@ class PodcastHandler(sax.handler.ContentHandler):
         self.data[key] = value
 
     def set_episode_attr(self, key, value):
-        self.episodes[-1][key] = value
+        self.episode[key] = value
 
     def get_episode_attr(self, key, default=None):
-        return self.episodes[-1].get(key, default)
+        return self.episode.get(key, default)
         
     def add_episode_persons(self):
-        self.episodes[-1]['persons'] = []
+        self.episode['persons'] = []
         
     def append_episode_person(self, value):
-        self.episodes[-1]['persons'].append(value)
+        self.episode['persons'].append(value)
+
+    def append_episode_chapter(self, chapter):
+        # Most episodes have no chapters, so only create the list when needed
+        self.episode.setdefault('chapters', []).append(chapter)
 
     def add_episode(self):
-        self.episodes.append({
+        self.episode = {
             # title
             'description': '',
             # url
@@ -866,15 +1135,12 @@ class PodcastHandler(sax.handler.ContentHandler):
             'total_time': 0,
             'payment_url': None,
             'enclosures': [],
-            '_guid_is_permalink': False,
-            'chapters': [],
-        })
+        }
+        self.guid_is_permalink = False
 
     def validate_episode(self):
-        entry = self.episodes[-1]
-
-        if len(entry['chapters']) == 0:
-            del entry['chapters']
+        entry = self.episode
+        self.episode = None
 
         # Ensures `description` does not contain HTML
         if is_html(entry['description']):
@@ -893,7 +1159,6 @@ class PodcastHandler(sax.handler.ContentHandler):
             else:
                 if len(set(enclosure['url'] for enclosure in entry['enclosures'])) != 1:
                     # Multi-enclosure feeds MUST have a GUID or the same URL for all enclosures
-                    self.episodes.pop()
                     return
 
                 # Maemo bug 12073
@@ -901,19 +1166,30 @@ class PodcastHandler(sax.handler.ContentHandler):
 
         if 'title' not in entry:
             if len(entry['enclosures']) != 1:
-                self.episodes.pop()
                 return
 
             entry['title'] = file_basename_no_extension(
                 entry['enclosures'][0]['url'])
 
-        if not entry.get('link') and entry.get('_guid_is_permalink'):
+        if not entry.get('link') and self.guid_is_permalink:
             entry['link'] = entry['guid']
 
-        del entry['_guid_is_permalink']
+        if not self.max_episodes:
+            self.episodes.append(entry)
+            return
+
+        published = entry['published']
+        sequence = self.episode_count
+        self.episode_count += 1
+        if sequence < self.max_episodes:
+            heapq.heappush(self.newest_episodes, (published, -sequence, entry))
+            heapq.heappush(self.oldest_episodes, (-published, -sequence, entry))
+        else:
+            heapq.heappushpop(self.newest_episodes, (published, -sequence, entry))
+            heapq.heappushpop(self.oldest_episodes, (-published, -sequence, entry))
 
     def add_enclosure(self, url, file_size, mime_type):
-        self.episodes[-1]['enclosures'].append({
+        self.episode['enclosures'].append({
             'url': url,
             'file_size': file_size,
             'mime_type': mime_type,
@@ -936,36 +1212,86 @@ class PodcastHandler(sax.handler.ContentHandler):
         entry.append(value)
 
     def startElement(self, name, attrs):
-        self.namespace = Namespace(attrs, self.namespace)
-        name = self.namespace.map(name)
-        if not self.path_stack and name not in VALID_ROOTS:
-            raise FeedParseError(
-                msg='Unsupported feed type: {}'.format(name),
-                exception=None,
-                locator=self._locator,
-            )
-        self.path_stack.append(name)
-
-        target = MAPPING.get('/'.join(self.path_stack))
-        if target is not None:
-            target.start(self, attrs)
-            if target.WANT_TEXT:
-                self.text = []
-
-    def characters(self, chars):
-        if self.text is not None:
-            self.text.append(chars)
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
+
+        namespace = self.namespace
+        if namespace is None or any(key.startswith('xmlns') for key in attrs.keys()):
+            namespace = Namespace(attrs, namespace)
+        # else: no new prefix bindings, so the parent's namespace applies
+        name = namespace.map(name)
+
+        entry = self.node.get(name)
+        if entry is None:
+            if not self.stack:
+                raise FeedParseError(
+                    msg='Unsupported feed type: {}'.format(name),
+                    exception=None,
+                    locator=self._locator,
+                )
+
+            self.skip_depth = 1
+            return
+
+        node, methods = entry
+        # Restored and reused by endElement(), without looking up again
+        self.stack.append((self.node, methods))
+        self.node = node
+        self.namespace_stack.append(self.namespace)
+        self.namespace = namespace
+        if methods is not None:
+            start, _, want_text = methods
+            if start is not None:
+                start(self, attrs)
+            if want_text:
+                self.want_text = True
+                self.text.clear()
 
     def endElement(self, name):
-        target = MAPPING.get('/'.join(self.path_stack))
-        if target is not None:
-            content = ''.join(self.text) if self.text is not None else ''
-            target.end(self, content)
-            self.text = None
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+
+        self.node, methods = self.stack.pop()
+        self.namespace = self.namespace_stack.pop()
+        if methods is not None:
+            end = methods[1]
+            if end is not None:
+                end(self, ''.join(self.text) if self.want_text else '')
+            self.want_text = False
+            self.text.clear()
+
+
+class _Locator(xmlreader.Locator):
+    """Locator for reporting parse errors as FeedParseError"""
+
+    def __init__(self, line=-1, column=-1):
+        self._line = line
+        self._column = column
+
+    def getColumnNumber(self):
+        return self._column
+
+    def getLineNumber(self):
+        return self._line
+
+
+class _ExpatLocator(xmlreader.Locator):
+    """Locator reporting the current position of an expat parser"""
 
-        if self.namespace is not None:
-            self.namespace = self.namespace.parent
-        self.path_stack.pop()
+    def __init__(self, parser):
+        self._parser = parser
+
+    def getColumnNumber(self):
+        return self._parser.CurrentColumnNumber
+
+    def getLineNumber(self):
+        return self._parser.CurrentLineNumber
+
+
+# Chunk size for reading feeds into the parser
+_READ_SIZE = 64 * 1024
 
 
 def parse(url, stream, max_episodes=0):
@@ -978,10 +1304,32 @@ def parse(url, stream, max_episodes=0):
     :returns: a dict with the parsed contents of the feed
     """
     handler = PodcastHandler(url, max_episodes)
+    # Without namespace processing, so that undeclared prefixes such as
+    # "itunes:" are accepted; Namespace maps prefixes in startElement()
+    parser = expat.ParserCreate()
+    # No external DTD or entities are ever loaded (no parameter entities
+    # and no ExternalEntityRefHandler), as with xml.sax's defaults
+    parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+    # Report character data in one piece instead of per line/entity
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.startElement
+    parser.EndElementHandler = handler.endElement
+    # Collect all character data without a Python level call; the
+    # handler only joins it for WANT_TEXT targets and clears it on every
+    # mapped element
+    parser.CharacterDataHandler = handler.text.append
+    handler.setDocumentLocator(_ExpatLocator(parser))
     try:
-        sax.parse(stream, handler)
-    except sax.SAXParseException as e:
-        raise FeedParseError(e.getMessage(), e.getException(), e._locator)
+        # ParseFile() reads in small (2 KiB) chunks and only accepts bytes,
+        # Parse() also accepts str
+        while True:
+            data = stream.read(_READ_SIZE)
+            parser.Parse(data, not data)
+            if not data:
+                break
+    except expat.ExpatError as e:
+        raise FeedParseError(expat.ErrorString(e.code), e,
+                             _Locator(e.lineno, e.offset))
     return handler.data
 
 
@@ -1056,7 +1404,7 @@ def normalize_feed_url(url):
     return urlparse.urlunsplit((scheme, netloc, path, query, fragment))
 
 
-HTML_TEST = re.compile(r'<[a-z][a-z0-9]*(?:\s.*?>|\/?>)', re.IGNORECASE | re.DOTALL)
+HTML_TEST = re.compile(r'<[a-z][a-z0-9]*(?:\s[^>]*>|\/?>)', re.IGNORECASE)
 
 
 def is_html(text):
@@ -1067,43 +1415,62 @@ def is_html(text):
     True
     >>> is_html('a < b < c')
     False
+    >>> is_html('no tags at all')
+    False
+    >>> is_html('a <b c')
+    False
+    >>> is_html('a <br\\nclass="x">')
+    True
     """
+    # Any tag needs both, so most plain text is ruled out without a regex
+    if '<' not in text or '>' not in text:
+        return False
     return bool(HTML_TEST.search(text))
 
 
+_STRIP_TAGS_RE = re.compile(r'<[^>]*>')
+_NEWLINE_TAGS_RE = re.compile(r'(<br[^>]*>|<[/]?ul[^>]*>|</li>)', re.I)
+_LISTING_TAGS_RE = re.compile(r'<li[^>]*>', re.I)
+_P_TAG_RE = re.compile(r'<[Pp]>')
+_NEWLINES_RE = re.compile(r'([\r\n]{2})([\r\n])+')
+
+
 def remove_html_tags(html):
     """
     Remove HTML tags from a string and replace numeric and
     named entities with the corresponding character, so the
     HTML text can be displayed in a simple text view.
+
+    >>> remove_html_tags('<p>Tom &amp; Jerry&#39;s <b>show</b></p>')
+    "Tom & Jerry's show"
+    >>> remove_html_tags('Caf&eacute; &#x2013; &copy 2020')
+    'Café – © 2020'
+    >>> remove_html_tags('<ul><li>one</li><li>two</li></ul>')
+    '* one\\n\\n * two'
+    >>> remove_html_tags(' no\\r\\n\\r\\n\\r\\nmarkup ')
+    'no\\r\\nmarkup'
     """
     if html is None:
         return None
 
-    # If we would want more speed, we could make these global
-    re_strip_tags = re.compile(r'<[^>]*>')
-    re_unicode_entities = re.compile(r'&#(\d{2,4});')
-    re_html_entities = re.compile(r'&(.{2,8});')
-    re_newline_tags = re.compile(r'(<br[^>]*>|<[/]?ul[^>]*>|</li>)', re.I)
-    re_listing_tags = re.compile(r'<li[^>]*>', re.I)
-
     result = html
 
-    # Convert common HTML elements to their text equivalent
-    result = re_newline_tags.sub(r'\n', result)
-    result = re_listing_tags.sub(r'\n * ', result)
-    result = re.sub(r'<[Pp]>', r'\n\n', result)
-
-    # Remove all HTML/XML tags from the string
-    result = re_strip_tags.sub('', result)
+    # Plain text (e.g. after is_html() returned False) has no tags
+    if '<' in result:
+        # Convert common HTML elements to their text equivalent
+        result = _NEWLINE_TAGS_RE.sub(r'\n', result)
+        result = _LISTING_TAGS_RE.sub(r'\n * ', result)
+        result = _P_TAG_RE.sub(r'\n\n', result)
 
-    # Convert numeric XML entities to their unicode character
-    result = re_unicode_entities.sub(lambda x: chr(int(x.group(1))), result)
+        # Remove all HTML/XML tags from the string
+        result = _STRIP_TAGS_RE.sub('', result)
 
-    # Convert named HTML entities to their unicode character
-    result = re_html_entities.sub(lambda x: entitydefs.get(x.group(1), ''), result)
+    if '&' in result:
+        # Convert numeric (decimal and hex) XML entities and named HTML
+        # entities to their unicode character
+        result = unescape(result)
 
     # Convert more than two newlines to two newlines
-    result = re.sub(r'([\r\n]{2})([\r\n])+', r'\1', result)
+    result = _NEWLINES_RE.sub(r'\1', result)
 
     return result.strip()
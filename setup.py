@@ -26,6 +26,13 @@ LONG_DESCRIPTION = open('README.md').read()
 # Extract name and e-mail ("Firstname Lastname <mail@example.org>")
 AUTHOR, EMAIL = re.match(r'(.*) <(.*)>', AUTHOR_EMAIL).groups()
 
+# Optionally compile the (unmodified) module with Cython for faster parsing,
+# the pure Python module is installed as a fallback either way
+EXT_MODULES = []
+if os.environ.get('USE_CYTHON'):
+    from Cython.Build import cythonize
+    EXT_MODULES = cythonize(['podcastparser.py'], language_level=3)
+
 setup(name=PACKAGE,
       version=VERSION,
       description=DESCRIPTION,
@@ -35,4 +42,5 @@ setup(name=PACKAGE,
       author_email=EMAIL,
       license=LICENSE,
       url=WEBSITE,
-      py_modules=MODULES)
+      py_modules=MODULES,
+      ext_modules=EXT_MODULES)
@@ -19,7 +19,6 @@
 
 
 import os
-import glob
 import json
 import io
 
@@ -28,25 +27,50 @@ import pytest
 import podcastparser
 
 
-class TestPodcastparser:
-    # test RSS parsing
-    @pytest.mark.parametrize("rss_filename", glob.glob(os.path.join('tests', 'data', '*.rss')))
-    def test_parse_rss(self, rss_filename):
+# Names of all fixture files, from a single directory scan
+data_dir = os.path.join('tests', 'data')
+data_files = set(entry.name for entry in os.scandir(data_dir))
+
+# Sorted, so that the test IDs are the same for each pytest-xdist worker
+rss_filenames = sorted(os.path.join(data_dir, name)
+                       for name in data_files if name.endswith('.rss'))
+
+
+def load_json(filename):
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+# Fixtures are shared by all tests, so only load them once
+@pytest.fixture(scope='session')
+def rss_cases():
+    """Map each .rss file to its content, expected result and parameters"""
+    cases = {}
+    for rss_filename in rss_filenames:
         basename, _ = os.path.splitext(rss_filename)
-        json_filename = basename + '.json'
+        with open(rss_filename, 'rb') as fp:
+            content = fp.read()
 
         # read parameters to podcastparser.parse() from a separate file
         param_filename = basename + '.param.json'
         params = {}
-        if os.path.exists(param_filename):
-            params = json.load(open(param_filename))
+        if os.path.basename(param_filename) in data_files:
+            params = load_json(param_filename)
+
+        cases[rss_filename] = (content, load_json(basename + '.json'), params)
+    return cases
 
-        expected = json.load(open(json_filename))
+
+class TestPodcastparser:
+    # test RSS parsing
+    @pytest.mark.parametrize("rss_filename", rss_filenames, ids=os.path.basename)
+    def test_parse_rss(self, rss_filename, rss_cases):
+        content, expected, params = rss_cases[rss_filename]
         normalized_rss_filename = rss_filename
         if os.sep == '\\':
             normalized_rss_filename = normalized_rss_filename.replace(os.sep, '/')
         parsed = podcastparser.parse('file://' + normalized_rss_filename,
-                                     open(rss_filename), **params)
+                                     io.BytesIO(content), **params)
 
         assert expected == parsed
 
@@ -61,3 +85,36 @@ class TestPodcastparser:
         with pytest.raises(podcastparser.FeedParseError):
             podcastparser.parse('file://example.com/feed.xml', io.StringIO(feed))
 
+    # test malformed XML
+    malformed_feeds = [
+        '',
+        '<rss><channel>',
+        '<rss><channel><title>&nbsp;</title></channel></rss>',
+        '<rss><channel></chanel></rss>',
+    ]
+    @pytest.mark.parametrize("feed", malformed_feeds)
+    def test_fail_parse_malformed(self, feed):
+        with pytest.raises(podcastparser.FeedParseError):
+            podcastparser.parse('file://example.com/feed.xml', io.BytesIO(feed.encode('utf-8')))
+
+    # external entities must not be resolved
+    def test_external_entities(self, tmp_path):
+        secret = tmp_path / 'secret.txt'
+        secret.write_text('secret')
+        feed = ('<!DOCTYPE rss [<!ENTITY e SYSTEM "{0}"><!ENTITY % p SYSTEM "{0}"> %p;]>'
+                '<rss><channel><title>a&e;b</title></channel></rss>').format(secret.as_uri())
+        parsed = podcastparser.parse('file://example.com/feed.xml', io.BytesIO(feed.encode('utf-8')))
+        assert parsed['title'] == 'ab'
+
+    # str streams are parsed, too
+    def test_parse_text_stream(self):
+        feed = '<rss><channel><title>T\u00e9st</title></channel></rss>'
+        parsed = podcastparser.parse('file://example.com/feed.xml', io.StringIO(feed))
+        assert parsed['title'] == 'T\u00e9st'
+
+    # feeds are read in chunks, which may split multi-byte characters
+    def test_parse_chunked_stream(self, monkeypatch):
+        monkeypatch.setattr(podcastparser, '_READ_SIZE', 5)
+        feed = '<rss><channel><title>Tést – \U0001f3a7</title></channel></rss>'
+        parsed = podcastparser.parse('file://example.com/feed.xml', io.BytesIO(feed.encode('utf-8')))
+        assert parsed['title'] == 'Tést – \U0001f3a7'